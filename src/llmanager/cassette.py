@@ -0,0 +1,391 @@
+import os
+import json
+import time
+import base64
+import hashlib
+import threading
+from enum import Enum
+from typing import Optional
+from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode
+
+import httpx
+import requests
+from requests.structures import CaseInsensitiveDict
+
+from logging_config import logger
+
+
+class CassetteMode(Enum):
+    RECORD = "record"
+    REPLAY = "replay"
+
+
+# Chunks received closer than this are stored as a single chunk, to keep cassettes compact.
+COALESCE_DELAY = 0.001
+
+# Headers describing the encoding of the body, dropped when the stored body is already decoded.
+ENCODING_HEADERS = ("content-encoding", "content-length", "transfer-encoding")
+
+
+class Cassette:
+    """
+    File of recorded request/response pairs, used to replay provider calls without the network.
+
+    The cassette is a JSON lines file with one response per line: its status, headers and
+    body chunks with the delay before each chunk. Responses are looked up by a hash of the
+    method, URL and body of the request, through an index file mapping each hash to the
+    offsets of its lines, so only the replayed lines are read from the cassette.
+    Identical requests are replayed in the order they were recorded.
+
+    Recording starts a new cassette: an existing file at the same path is emptied.
+    """
+
+    def __init__(self, path: str, mode: CassetteMode, speed: float = 1.0):
+        """
+        Args:
+            path: The path of the cassette file.
+            mode: Whether to record new responses or replay the recorded ones.
+            speed: Replay speed factor: 1.0 keeps the recorded timing, 2.0 is twice as fast,
+                0 replays without any delay.
+        """
+        self.path = path
+        self.mode = mode
+        self.speed = speed
+        self._lock = threading.Lock()
+        self._index = None
+        self._replayed = {}
+        if mode is CassetteMode.REPLAY and not os.path.exists(path):
+            raise ValueError(f"Cassette '{path}' does not exist, record it first")
+        if mode is CassetteMode.RECORD:
+            open(path, "wb").close()
+            if os.path.exists(self.index_path):
+                os.remove(self.index_path)
+
+    @property
+    def index_path(self):
+        return f"{self.path}.idx"
+
+    @staticmethod
+    def request_key(method: str, url: str, body: Optional[bytes]):
+        """Return the hash identifying a request.
+
+        The API key query parameter is left out, and JSON bodies are hashed in canonical form.
+        """
+        parts = urlsplit(url)
+        query = urlencode(sorted((k, v) for k, v in parse_qsl(parts.query) if k != "key"))
+        url = urlunsplit((parts.scheme, parts.netloc, parts.path, query, ""))
+
+        body = body or b""
+        if isinstance(body, str):
+            body = body.encode()
+        try:
+            body = json.dumps(json.loads(body), sort_keys=True, separators=(",", ":")).encode()
+        except ValueError:
+            pass
+
+        digest = hashlib.sha256()
+        digest.update(f"{method.upper()} {url}\n".encode())
+        digest.update(body)
+        return digest.hexdigest()
+
+    def record(self, key: str, method: str, url: str, status: int, headers: list, chunks: list,
+               truncated: bool = False):
+        """Append a response to the cassette.
+
+        Args:
+            key: The hash of the request, see request_key().
+            method: The method of the request.
+            url: The URL of the request.
+            status: The status code of the response.
+            headers: The headers of the response as a list of (name, value) pairs.
+            chunks: The body of the response as a list of (delay in seconds, bytes) pairs.
+            truncated: Whether the caller stopped reading the body before its end.
+        """
+        entry = {
+            "key": key,
+            "method": method,
+            "url": url.split("?")[0],
+            "status": status,
+            "headers": [[name, value] for name, value in headers],
+            "chunks": [[round(delay, 4), base64.b64encode(chunk).decode()] for delay, chunk in chunks],
+        }
+        if truncated:
+            entry["truncated"] = True
+        line = (json.dumps(entry, separators=(",", ":")) + "\n").encode()
+        with self._lock:
+            with open(self.path, "ab") as cassette_file:
+                cassette_file.write(line)
+
+    def lookup(self, key: str):
+        """Return the next recorded response for a request.
+
+        Args:
+            key: The hash of the request, see request_key().
+
+        Returns:
+            The recorded entry, with its chunks decoded to (delay, bytes) pairs.
+
+        Raises:
+            LookupError: If the request was never recorded.
+        """
+        with self._lock:
+            offsets = self._load_index().get(key)
+            if not offsets:
+                raise LookupError(f"Request {key[:12]} is not recorded in cassette '{self.path}'")
+            count = self._replayed.get(key, 0)
+            self._replayed[key] = count + 1
+            offset = offsets[min(count, len(offsets) - 1)]
+
+            with open(self.path, "rb") as cassette_file:
+                cassette_file.seek(offset)
+                entry = json.loads(cassette_file.readline())
+
+        entry["chunks"] = [(delay, base64.b64decode(chunk)) for delay, chunk in entry["chunks"]]
+        return entry
+
+    def replay_chunks(self, chunks: list):
+        """Yield the recorded chunks of a response, waiting the recorded delays scaled by the speed."""
+        for delay, chunk in chunks:
+            if self.speed > 0:
+                time.sleep(delay / self.speed)
+            yield chunk
+
+    def _load_index(self):
+        # Called with the lock held: read the index file, or rebuild it if it is missing or outdated.
+        if self._index is not None:
+            return self._index
+
+        stat = os.stat(self.path)
+        try:
+            with open(self.index_path, "r") as index_file:
+                index = json.load(index_file)
+            if index["size"] == stat.st_size and index["mtime"] == stat.st_mtime_ns:
+                self._index = index["offsets"]
+                return self._index
+        except (OSError, ValueError, KeyError):
+            pass
+
+        logger.info(f"Indexing cassette '{self.path}'...")
+        offsets = {}
+        with open(self.path, "rb") as cassette_file:
+            offset = 0
+            for line in cassette_file:
+                if line.strip():
+                    offsets.setdefault(json.loads(line)["key"], []).append(offset)
+                offset += len(line)
+
+        try:
+            with open(self.index_path, "w") as index_file:
+                json.dump({"size": stat.st_size, "mtime": stat.st_mtime_ns, "offsets": offsets}, index_file)
+        except OSError as e:
+            logger.warning(f"Could not write the cassette index to {self.index_path}: {e}")
+
+        self._index = offsets
+        return self._index
+
+
+class Recorder:
+    """
+    Collects the chunks of a response body as they are read, and records them to the cassette once done.
+    """
+
+    def __init__(self, cassette: Cassette, key: str, method: str, url: str, status: int, headers: list, started: float):
+        self.cassette = cassette
+        self.key = key
+        self.method = method
+        self.url = url
+        self.status = status
+        self.headers = headers
+        self.chunks = []
+        self.last = started
+        self.done = False
+
+    def add(self, chunk: bytes):
+        if not chunk:
+            return
+        now = time.monotonic()
+        delay = now - self.last
+        self.last = now
+        if self.chunks and delay < COALESCE_DELAY:
+            previous_delay, previous_chunk = self.chunks[-1]
+            self.chunks[-1] = (previous_delay + delay, previous_chunk + chunk)
+        else:
+            self.chunks.append((delay, chunk))
+
+    def finish(self, truncated: bool = False):
+        if not self.done:
+            self.done = True
+            self.cassette.record(self.key, self.method, self.url, self.status, self.headers, self.chunks, truncated)
+
+
+class CassetteTransport(httpx.BaseTransport):
+    """
+    httpx transport recording or replaying the requests of the OpenAI, Anthropic and Ollama clients.
+    """
+
+    def __init__(self, cassette: Cassette, transport: Optional[httpx.BaseTransport] = None):
+        self.cassette = cassette
+        if transport is None and cassette.mode is CassetteMode.RECORD:
+            transport = httpx.HTTPTransport()
+        self.transport = transport
+
+    def handle_request(self, request: httpx.Request):
+        key = self.cassette.request_key(request.method, str(request.url), request.read())
+
+        if self.cassette.mode is CassetteMode.REPLAY:
+            entry = self.cassette.lookup(key)
+            return httpx.Response(
+                entry["status"],
+                headers=entry["headers"],
+                stream=_ReplayStream(self.cassette.replay_chunks(entry["chunks"])),
+                request=request,
+            )
+
+        # The delay of the first chunk includes the time the provider takes to answer.
+        started = time.monotonic()
+        response = self.transport.handle_request(request)
+        headers = [(name.decode("latin-1"), value.decode("latin-1")) for name, value in response.headers.raw]
+        recorder = Recorder(self.cassette, key, request.method, str(request.url), response.status_code, headers, started)
+        return httpx.Response(
+            response.status_code,
+            headers=response.headers,
+            stream=_RecordStream(response.stream, recorder),
+            request=request,
+            extensions=response.extensions,
+        )
+
+    def close(self):
+        if self.transport is not None:
+            self.transport.close()
+
+
+class _ReplayStream(httpx.SyncByteStream):
+
+    def __init__(self, chunks):
+        self.chunks = chunks
+
+    def __iter__(self):
+        yield from self.chunks
+
+
+class _RecordStream(httpx.SyncByteStream):
+
+    def __init__(self, stream, recorder: Recorder):
+        self.stream = stream
+        self.recorder = recorder
+
+    def __iter__(self):
+        for chunk in self.stream:
+            self.recorder.add(chunk)
+            yield chunk
+        self.recorder.finish()
+
+    def close(self):
+        # Responses closed before the end are still recorded, marked as truncated.
+        self.recorder.finish(truncated=True)
+        self.stream.close()
+
+
+class CassetteAdapter(requests.adapters.HTTPAdapter):
+    """
+    requests adapter recording or replaying the requests of the Google REST client.
+
+    Bodies are stored decoded, so the headers describing their encoding are dropped.
+    """
+
+    def __init__(self, cassette: Cassette):
+        super().__init__()
+        self.cassette = cassette
+
+    def send(self, request, stream=False, timeout=None, verify=True, cert=None, proxies=None):
+        key = self.cassette.request_key(request.method, request.url, request.body)
+
+        if self.cassette.mode is CassetteMode.REPLAY:
+            entry = self.cassette.lookup(key)
+            raw = _RawChunks(self.cassette.replay_chunks(entry["chunks"]))
+            return self._build(request, entry["status"], entry["headers"], raw, stream)
+
+        started = time.monotonic()
+        response = super().send(request, stream=True, timeout=timeout, verify=verify, cert=cert, proxies=proxies)
+        headers = [(name, value) for name, value in response.headers.items() if name.lower() not in ENCODING_HEADERS]
+        recorder = Recorder(self.cassette, key, request.method, request.url, response.status_code, headers, started)
+        raw = _RawChunks(response.raw.stream(requests.models.CONTENT_CHUNK_SIZE, decode_content=True), recorder, response)
+        return self._build(request, response.status_code, headers, raw, stream)
+
+    def _build(self, request, status: int, headers: list, raw, stream: bool):
+        response = requests.Response()
+        response.status_code = status
+        response.headers = CaseInsensitiveDict(
+            {name: value for name, value in headers if name.lower() not in ENCODING_HEADERS}
+        )
+        response.encoding = requests.utils.get_encoding_from_headers(response.headers)
+        response.raw = raw
+        response.url = request.url
+        response.request = request
+        response.connection = self
+        if not stream:
+            response.content
+        return response
+
+
+class _RawChunks:
+    # Minimal stand-in for urllib3.HTTPResponse, as used by requests.Response.iter_content().
+
+    def __init__(self, chunks, recorder: Optional[Recorder] = None, response: Optional[requests.Response] = None):
+        self.chunks = chunks
+        self.recorder = recorder
+        self.response = response
+
+    def stream(self, amt=None, decode_content=True):
+        for chunk in self.chunks:
+            if self.recorder is not None:
+                self.recorder.add(chunk)
+            yield chunk
+        if self.recorder is not None:
+            self.recorder.finish()
+
+    def read(self, amt=None, decode_content=True):
+        return b"".join(self.stream())
+
+    def close(self):
+        if self.recorder is not None:
+            self.recorder.finish(truncated=True)
+        if self.response is not None:
+            self.response.close()
+
+    def release_conn(self):
+        pass
+
+
+_cassettes = {}
+_cassettes_lock = threading.Lock()
+
+
+def load_cassette(config):
+    """Return the cassette configured in an LLMConfig, shared by all the LLMs using the same file.
+
+    Args:
+        config (LLMConfig): The config of the LLM.
+
+    Returns:
+        The Cassette, or None if record/replay is disabled.
+
+    Raises:
+        ValueError: If only one of cassette and cassette_mode is set, or if the cassette is
+            already open in the other mode in this process.
+    """
+    if config.cassette is None and config.cassette_mode is None:
+        return None
+    if config.cassette is None or config.cassette_mode is None:
+        raise ValueError("Both 'cassette' and 'cassette_mode' should be set to record or replay provider calls")
+
+    path = os.path.abspath(config.cassette)
+    with _cassettes_lock:
+        cassette = _cassettes.get(path)
+        if cassette is not None and cassette.mode is not config.cassette_mode:
+            # Recording would empty the file under the LLMs replaying it, and the other way around.
+            raise ValueError(f"Cassette '{path}' is already open in {cassette.mode.value} mode")
+        if cassette is None or (cassette.mode is CassetteMode.REPLAY and cassette.speed != config.replay_speed):
+            cassette = Cassette(path, config.cassette_mode, config.replay_speed)
+            _cassettes[path] = cassette
+        return cassette
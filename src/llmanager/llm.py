@@ -1,9 +1,12 @@
 import os
+import httpx
 from dotenv import load_dotenv
 from abc import ABC, abstractmethod
 
 from llm_config import LLMConfig
 from logging_config import logger
+from model_catalog import catalog
+from cassette import CassetteMode, CassetteTransport, load_cassette
 
 load_dotenv()
 
@@ -34,7 +37,9 @@ class LLM(ABC):
             logger.debug("Config:")
             for key, value in self.config.model_dump().items():
                 logger.debug(f" - {key}: {value}")
+        self.cassette = load_cassette(self.config)
         self.load_api_key()
+        catalog.validate(self.config)
         
     def load_api_key(self):
         """Load the API key from the environment variable.
@@ -44,9 +49,92 @@ class LLM(ABC):
         self.api_key_env_name = f"{self.config.provider.name}_API_KEY"
         if self.config.verbose:
             logger.debug(f"API Key Environment Variable: {self.api_key_env_name}: {os.getenv(self.api_key_env_name)}")
+        if self.replaying():
+            # Replayed calls never reach the provider, see client_api_key().
+            return
         if not self.api_key_env_name in os.environ:
             raise ValueError(f"{self.api_key_env_name} environment variable should be set in the '.env' file")
 
+    def replaying(self):
+        """Return whether the provider calls are replayed from a cassette."""
+        return self.cassette is not None and self.cassette.mode is CassetteMode.REPLAY
+
+    def client_api_key(self):
+        """Return the API key to give to the provider client, or None to let it read the environment.
+
+        When replaying, a placeholder key is returned if none is set, since the clients still expect one.
+        """
+        if self.replaying() and not os.getenv(self.api_key_env_name):
+            return "replay"
+        return None
+
+    def catalog_fetcher(self):
+        """Return the fetcher the model catalog refreshes with, or None when recording or replaying,
+        so that the cassette alone determines the provider calls."""
+        if self.cassette is not None:
+            return None
+        return self.fetch_models
+
+    def http_transport(self):
+        """Return the httpx transport recording or replaying the provider calls, or None if disabled."""
+        if self.cassette is None:
+            return None
+        return CassetteTransport(self.cassette)
+
+    def http_client(self):
+        """Return an httpx client using http_transport(), or None to let the provider client create its own."""
+        transport = self.http_transport()
+        if transport is None:
+            return None
+        return httpx.Client(transport=transport)
+
+    @property
+    def model_info(self):
+        """The catalog record of the configured model, or None if the model is not in the catalog.
+
+        Reading it refreshes the provider's records in the background when they are stale.
+        """
+        return catalog.get(self.config.provider, self.config.model, fetcher=self.catalog_fetcher())
+
+    def history_budget(self):
+        """Return the number of tokens the message thread can use, or None if unknown.
+
+        This is the context window of the model minus the tokens reserved for the answer.
+        """
+        model_info = self.model_info
+        if model_info is None or model_info.context_window is None:
+            return None
+        return model_info.context_window - (self.config.max_tokens or 0)
+
+    def trim_thread(self):
+        """Drop the oldest messages of the thread until it fits in the history budget.
+
+        System messages and the last message are always kept, and the thread is made
+        to start with a user message again. Tokens are estimated from the message length.
+        """
+        budget = self.history_budget()
+        if budget is None:
+            return
+
+        def count_tokens(message):
+            text = message.get("content") or "".join(str(part) for part in message.get("parts", []))
+            return len(str(text)) // 4 + 4
+
+        total = sum(count_tokens(message) for message in self.messages)
+        dropped = 0
+        while total > budget or (dropped and self._first_turn_role() not in (None, "user")):
+            index = next((i for i, message in enumerate(self.messages[:-1]) if message["role"] != "system"), None)
+            if index is None:
+                break
+            total -= count_tokens(self.messages.pop(index))
+            dropped += 1
+
+        if dropped and self.config.verbose:
+            logger.debug(f"Dropped {dropped} messages to fit the history budget of {budget} tokens")
+
+    def _first_turn_role(self):
+        return next((message["role"] for message in self.messages[:-1] if message["role"] != "system"), None)
+
     @abstractmethod
     def stream_response(self, response):
         """Stream the response from the model.
@@ -125,11 +213,34 @@ class LLM(ABC):
         """
         pass
 
-    @abstractmethod
-    def list_models(self):
+    def list_models(self, refresh: bool = False):
         """List the available models for the provider.
 
+        The models are read from the model catalog, and refreshed in the background when stale.
+
+        Args:
+            refresh: Whether to fetch the models from the provider right away.
+
+        Returns:
+            The list of ModelInfo of the provider.
+        """
+        models = catalog.models(self.config.provider, fetcher=self.catalog_fetcher(), refresh=refresh)
+        logger.info(f"Available models for {self.name} LLM:")
+        for model in models:
+            logger.info(f" - {model.name}: context_window={model.context_window}, max_output_tokens={model.max_output_tokens}, "
+                        f"streaming={model.streaming}, json_mode={model.json_mode}, vision={model.vision}, "
+                        f"price=${model.input_price}/${model.output_price} per 1M tokens")
+        return models
+
+    @abstractmethod
+    def fetch_models(self):
+        """Fetch the available models from the provider.
+
         This method should be implemented by the child class.
-        It should list the available models for the provider.
+        It is called by the model catalog to refresh its records, and should return
+        the models currently offered by the provider.
+
+        Returns:
+            The list of ModelInfo of the provider.
         """
         pass
\ No newline at end of file
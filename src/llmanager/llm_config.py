@@ -5,6 +5,7 @@ import jsonschema
 from pydantic import BaseModel
 
 from provider import Provider
+from cassette import CassetteMode
 
 
 class LLMConfig(BaseModel):
@@ -37,6 +38,17 @@ class LLMConfig(BaseModel):
     stream: bool = False
     """Whether to stream the response or not"""
 
+    # Record/Replay Parameters
+
+    cassette: Optional[str] = None
+    """The path of the cassette file to record the provider calls to or replay them from"""
+
+    cassette_mode: Optional[CassetteMode] = None
+    """Whether to record the provider calls or replay the recorded ones"""
+
+    replay_speed: float = 1.0
+    """The replay speed factor of the recorded timing (0 replays without any delay)"""
+
     # Logging Parameters
 
     verbose: bool = False
@@ -5,6 +5,7 @@ from anthropic import Anthropic
 
 from llm import LLM, LLMConfig
 from logging_config import logger
+from model_catalog import ModelInfo
 
 
 class AnthropicLLM(LLM):
@@ -15,7 +16,7 @@ class AnthropicLLM(LLM):
     def __init__(self, config: LLMConfig):
         super().__init__(config)
         self.name = "Anthropic"
-        self.client = Anthropic()
+        self.client = Anthropic(api_key=self.client_api_key(), http_client=self.http_client())
         self.messages = []
 
     def load_api_key(self):
@@ -56,6 +57,7 @@ class AnthropicLLM(LLM):
             The response from the model
         """
         self.add_message_to_thread(message, role="user")
+        self.trim_thread()
 
         if self.config.json_mode:
             self.add_message_to_thread("Here is the JSON requested:\n{", role="assistant")
@@ -97,7 +99,7 @@ class AnthropicLLM(LLM):
 
             return answer
 
-    def list_models(self):
-        logger.info(f"Available models for {self.name} LLM:")
-        models = ["claude-3-opus-20240229", "anthropic.claude-3-sonnet-20240229", "claude-3-haiku-20240307"]
-        logger.info(models)
\ No newline at end of file
+    def fetch_models(self):
+        # The Anthropic API does not list models, so the known ones are returned.
+        models = ["claude-3-opus-20240229", "claude-3-sonnet-20240229", "claude-3-haiku-20240307"]
+        return [ModelInfo(provider=self.config.provider, name=model) for model in models]
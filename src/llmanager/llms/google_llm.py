@@ -1,3 +1,4 @@
+import os
 import sys
 
 from google.ai import generativelanguage as glm
@@ -5,6 +6,8 @@ import google.generativeai as genai
 
 from llm import LLM, LLMConfig
 from logging_config import logger
+from model_catalog import ModelInfo
+from cassette import CassetteAdapter
 
 
 #https://ai.google.dev/gemini-api/docs/get-started/python?hl=en
@@ -19,12 +22,27 @@ class GoogleLLM(LLM):
         self.name = "Google"
         genai.configure() # api_key defaults to os.getenv('GOOGLE_API_KEY')
         self.client = genai.GenerativeModel(self.config.model)
+        if self.cassette is not None:
+            self.client._client = self.cassette_client()
         self.messages = []
         #self.thread = self.client.start_chat(history=self.messages)
 
     def load_api_key(self):
         super().load_api_key()
 
+    def cassette_client(self):
+        """Return a dedicated REST client whose calls go through the cassette.
+
+        The SDK has no hook for its HTTP session, so the cassette is mounted on the session of
+        this client only, leaving the process-wide default client of genai untouched.
+        """
+        client = glm.GenerativeServiceClient(
+            transport="rest",
+            client_options={"api_key": self.client_api_key() or os.getenv(self.api_key_env_name)},
+        )
+        client._transport._session.mount("https://", CassetteAdapter(self.cassette))
+        return client
+
     def chat_loop(self):
         print(f"Welcome to the {self.name} LLM chat loop!")
         return super().chat_loop()
@@ -62,6 +80,7 @@ class GoogleLLM(LLM):
         """
 
         self.add_message_to_thread(message, role="user")
+        self.trim_thread()
 
         # Query the model.
         try:
@@ -97,7 +116,13 @@ class GoogleLLM(LLM):
 
             return answer
 
-    def list_models(self):
-        logger.info(f"Available models for {self.name} LLM:")
-        models = [model.name.split('/')[-1] for model in genai.list_models() if 'generateContent' in model.supported_generation_methods]
-        logger.info(models)
+    def fetch_models(self):
+        return [
+            ModelInfo(
+                provider=self.config.provider,
+                name=model.name.split('/')[-1],
+                context_window=model.input_token_limit,
+                max_output_tokens=model.output_token_limit,
+            )
+            for model in genai.list_models() if 'generateContent' in model.supported_generation_methods
+        ]
@@ -6,6 +6,7 @@ import ollama
 
 from llm import LLM, LLMConfig
 from logging_config import logger
+from model_catalog import ModelInfo
 
 
 # RUN curl -fsSL https://ollama.com/install.sh | sh
@@ -17,7 +18,7 @@ class OllamaLLM(LLM):
     def __init__(self, config: LLMConfig):
         super().__init__(config)
         self.name = "Ollama"
-        self.client = ollama.Client()
+        self.client = ollama.Client(transport=self.http_transport())
         self.messages = []
 
     def load_api_key(self):
@@ -57,17 +58,18 @@ class OllamaLLM(LLM):
             The response from the model
         """
 
-        models = [model['name'] for model in ollama.list()['models']]
+        models = [model['name'] for model in self.client.list()['models']]
         if self.config.model not in models:
             logger.info(f"Pulling model {self.config.model}...")
-            ollama.pull(self.config.model)
+            self.client.pull(self.config.model)
             logger.info("Model pulled successfully.")
 
         self.add_message_to_thread(message, role="user")
+        self.trim_thread()
 
         # Query the model.
         try:
-            response = ollama.chat(
+            response = self.client.chat(
                 model=self.config.model,
                 messages=self.messages,
                 format="json" if self.config.json_mode else "",
@@ -105,12 +107,10 @@ class OllamaLLM(LLM):
 
             return answer
 
-    def list_models(self):
-        logger.info(f"Pulled models for {self.name} LLM:")
-        models = [model['name'] for model in ollama.list()['models']]
-        logger.info(models)
-        logger.info("-"*50)
-        logger.info(f"Available models for {self.name} LLM:")
-        models = requests.get("https://ollama-models.zwz.workers.dev/").json()['models']
-        models_with_tag = [f"{element['name']}:{tag}" for element in models for tag in element['tags']]
-        logger.info(models_with_tag)
\ No newline at end of file
+    def fetch_models(self):
+        # Pulled models first, then the ones available in the Ollama library.
+        pulled = [model['name'] for model in self.client.list()['models']]
+        library = requests.get("https://ollama-models.zwz.workers.dev/", timeout=10).json()['models']
+        models_with_tag = [f"{element['name']}:{tag}" for element in library for tag in element['tags']]
+        models = list(dict.fromkeys(pulled + models_with_tag))
+        return [ModelInfo(provider=self.config.provider, name=model) for model in models]
@@ -5,6 +5,7 @@ from openai import OpenAI
 
 from llm import LLM, LLMConfig
 from logging_config import logger
+from model_catalog import ModelInfo
 
 
 class OpenaiLLM(LLM):
@@ -15,7 +16,7 @@ class OpenaiLLM(LLM):
     def __init__(self, config: LLMConfig):
         super().__init__(config)
         self.name = "OpenAI"
-        self.client = OpenAI()
+        self.client = OpenAI(api_key=self.client_api_key(), http_client=self.http_client())
         self.messages = []
 
     def load_api_key(self):
@@ -58,6 +59,7 @@ class OpenaiLLM(LLM):
             The response from the model
         """
         self.add_message_to_thread(message, role="user")
+        self.trim_thread()
 
         # Query the model.
         try:
@@ -98,8 +100,6 @@ class OpenaiLLM(LLM):
 
             return answer
 
-    def list_models(self):
-        logger.info(f"Available models for {self.name} LLM:")
+    def fetch_models(self):
         models = [model.id for model in self.client.models.list().data if str(model.id).startswith("gpt")]
-        logger.info(models)
-        
\ No newline at end of file
+        return [ModelInfo(provider=self.config.provider, name=model) for model in models]
@@ -36,7 +36,7 @@ def main(args: argparse.Namespace):
     llm = LLM(config)
 
     if args.list and provider:
-        llm.list_models()
+        llm.list_models(refresh=True)
         sys.exit(0)
 
     # Run the chat loop to interact with the model
@@ -0,0 +1,234 @@
+import os
+import json
+import time
+import threading
+from typing import Callable, Optional
+
+from pydantic import BaseModel
+
+from provider import Provider
+from logging_config import logger
+
+
+SEED_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "llms", "model_catalog.json")
+CACHE_PATH = os.path.join(os.path.expanduser("~"), ".cache", "llmanager", "model_catalog.json")
+
+# Number of seconds to wait before retrying a failed refresh (or the TTL, if shorter).
+RETRY_DELAY = 5 * 60
+
+
+class ModelInfo(BaseModel):
+
+    provider: Provider
+    """The provider of the model"""
+
+    name: str
+    """The model name, as used in LLMConfig.model"""
+
+    context_window: Optional[int] = None
+    """The maximum number of input and output tokens"""
+
+    max_output_tokens: Optional[int] = None
+    """The maximum number of tokens the model can generate"""
+
+    streaming: Optional[bool] = None
+    """Whether the model supports streaming"""
+
+    json_mode: Optional[bool] = None
+    """Whether the model supports JSON mode"""
+
+    vision: Optional[bool] = None
+    """Whether the model accepts images"""
+
+    input_price: Optional[float] = None
+    """The price in USD per million input tokens"""
+
+    output_price: Optional[float] = None
+    """The price in USD per million output tokens"""
+
+    def merge(self, other: "ModelInfo"):
+        """Return a copy of this record updated with the known fields of another one."""
+        return self.model_copy(update=other.model_dump(exclude_none=True))
+
+
+class ModelCatalog:
+    """
+    Cache of the models available for each provider.
+
+    Records are read from a local store (the cache file, or the seed file shipped with the
+    package when there is no cache yet), so reading the catalog never needs the network.
+    When the records of a provider are older than the TTL, they are refreshed in the background
+    with the fetcher of the provider and written back to the cache file.
+    """
+
+    def __init__(self, ttl: float = 24 * 60 * 60, cache_path: str = CACHE_PATH, seed_path: str = SEED_PATH):
+        """
+        Args:
+            ttl: Number of seconds after which the records of a provider are refreshed.
+            cache_path: The path of the JSON file the fetched records are stored in.
+            seed_path: The path of the JSON file with the records shipped with the package.
+        """
+        self.ttl = ttl
+        self.cache_path = cache_path
+        self.seed_path = seed_path
+        self._lock = threading.Lock()
+        self._entries = None
+        self._refreshing = set()
+        self._failed_at = {}
+
+    def models(self, provider: Provider, fetcher: Optional[Callable] = None, refresh: bool = False):
+        """Return the models available for a provider.
+
+        Args:
+            provider: The provider to list the models of.
+            fetcher: Function returning the up-to-date list of ModelInfo of the provider.
+                When given and the records are stale, they are refreshed in the background.
+            refresh: Whether to refresh the records right away and wait for the result.
+
+        Returns:
+            The list of ModelInfo of the provider.
+        """
+        self._refresh_if_needed(provider, fetcher, refresh)
+        with self._lock:
+            return list(self._load().get(provider, {}).get("models", {}).values())
+
+    def get(self, provider: Provider, name: str, fetcher: Optional[Callable] = None):
+        """Return the record of a model, or None if the model is not in the catalog.
+
+        Args:
+            provider: The provider of the model.
+            name: The model name.
+            fetcher: See models().
+        """
+        self._refresh_if_needed(provider, fetcher)
+        with self._lock:
+            return self._load().get(provider, {}).get("models", {}).get(name)
+
+    def is_stale(self, provider: Provider):
+        """Return whether the records of a provider should be refreshed.
+
+        After a failed refresh, the next one is only attempted after RETRY_DELAY (or the TTL, if shorter).
+        """
+        now = time.time()
+        with self._lock:
+            fetched_at = self._load().get(provider, {}).get("fetched_at", 0.0)
+            failed_at = self._failed_at.get(provider)
+        if failed_at is not None and now - failed_at < min(self.ttl, RETRY_DELAY):
+            return False
+        return now - fetched_at > self.ttl
+
+    def refresh(self, provider: Provider, fetcher: Callable):
+        """Fetch the models of a provider and store them in the cache file.
+
+        Fields the fetcher does not know about are kept from the previous records.
+
+        Args:
+            provider: The provider to refresh.
+            fetcher: Function returning the up-to-date list of ModelInfo of the provider.
+        """
+        try:
+            fetched = fetcher()
+        except Exception as e:
+            logger.warning(f"Could not refresh the {provider.name} model catalog: {e}")
+            with self._lock:
+                self._failed_at[provider] = time.time()
+            return
+
+        with self._lock:
+            self._failed_at.pop(provider, None)
+            known = self._load().get(provider, {}).get("models", {})
+            models = {}
+            for model in fetched:
+                models[model.name] = known[model.name].merge(model) if model.name in known else model
+            self._entries[provider] = {"fetched_at": time.time(), "models": models}
+            self._save()
+
+    def refresh_async(self, provider: Provider, fetcher: Callable):
+        """Refresh the models of a provider in a background thread, unless already refreshing."""
+        with self._lock:
+            if provider in self._refreshing:
+                return
+            self._refreshing.add(provider)
+
+        def run():
+            try:
+                self.refresh(provider, fetcher)
+            finally:
+                with self._lock:
+                    self._refreshing.discard(provider)
+
+        threading.Thread(target=run, name=f"{provider.value}-catalog-refresh", daemon=True).start()
+
+    def _refresh_if_needed(self, provider: Provider, fetcher: Optional[Callable], refresh: bool = False):
+        if fetcher is None:
+            return
+        if refresh:
+            self.refresh(provider, fetcher)
+        elif self.is_stale(provider):
+            self.refresh_async(provider, fetcher)
+
+    def validate(self, config):
+        """Check the model of an LLMConfig against the catalog.
+
+        Unknown models are only reported, since the catalog may be older than the provider's list.
+
+        Args:
+            config (LLMConfig): The config to check.
+
+        Returns:
+            The ModelInfo of the configured model, or None if the model is not in the catalog.
+        """
+        model = self.get(config.provider, config.model)
+        if model is None:
+            logger.warning(f"Model '{config.model}' is not in the {config.provider.name} model catalog")
+            return None
+        if model.max_output_tokens and config.max_tokens and config.max_tokens > model.max_output_tokens:
+            logger.warning(f"max_tokens={config.max_tokens} is above the {model.max_output_tokens} output tokens supported by '{model.name}'")
+        if config.json_mode and model.json_mode is False:
+            logger.warning(f"Model '{model.name}' does not support JSON mode")
+        return model
+
+    def _load(self):
+        # Called with the lock held: read the seed file, then the cache file on top of it, on first use.
+        if self._entries is not None:
+            return self._entries
+
+        self._entries = {}
+        for path in (self.seed_path, self.cache_path):
+            try:
+                with open(path, "r") as catalog_file:
+                    data = json.load(catalog_file)
+            except (OSError, json.JSONDecodeError):
+                continue
+            for provider in Provider:
+                if provider.value not in data:
+                    continue
+                entry = data[provider.value]
+                known = self._entries.get(provider, {}).get("models", {})
+                models = {}
+                for record in entry["models"]:
+                    model = ModelInfo(provider=provider, **record)
+                    models[model.name] = known[model.name].merge(model) if model.name in known else model
+                self._entries[provider] = {"fetched_at": entry.get("fetched_at", 0.0), "models": models}
+        return self._entries
+
+    def _save(self):
+        # Called with the lock held: write the records to the cache file atomically.
+        data = {
+            provider.value: {
+                "fetched_at": entry["fetched_at"],
+                "models": [model.model_dump(mode="json", exclude={"provider"}) for model in entry["models"].values()],
+            }
+            for provider, entry in self._entries.items()
+        }
+        try:
+            os.makedirs(os.path.dirname(self.cache_path), exist_ok=True)
+            tmp_path = f"{self.cache_path}.tmp"
+            with open(tmp_path, "w") as catalog_file:
+                json.dump(data, catalog_file, indent=4)
+            os.replace(tmp_path, self.cache_path)
+        except OSError as e:
+            logger.warning(f"Could not write the model catalog to {self.cache_path}: {e}")
+
+
+catalog = ModelCatalog()
@@ -0,0 +1,332 @@
+import time
+import heapq
+import weakref
+import itertools
+import threading
+from enum import Enum
+from contextlib import contextmanager
+from collections import defaultdict
+from typing import Optional
+
+from llm import LLM
+from provider import Provider
+from logging_config import logger
+
+
+class Priority(Enum):
+    INTERACTIVE = 0
+    BATCH = 1
+
+
+class Ticket:
+    """
+    A request waiting for (or holding) a slot in the scheduler.
+    """
+
+    def __init__(self, provider: Provider, model: str, priority: Priority, tenant: str,
+                 virtual_time: float, previous_finish: float, share: float, sequence: int):
+        self.provider = provider
+        self.model = model
+        self.priority = priority
+        self.tenant = tenant
+        self.virtual_time = virtual_time
+        self.previous_finish = previous_finish
+        self.share = share
+        self.start = max(virtual_time, previous_finish)
+        self.sequence = sequence
+        self.enqueued_at = time.monotonic()
+        self.queue_time = None
+        self.granted = threading.Event()
+        self.released = False
+
+    @property
+    def finish(self):
+        return self.start + self.share
+
+    def sort_key(self):
+        return (self.priority.value, self.start, self.sequence)
+
+
+class StreamSlot:
+    """
+    Iterator over a streamed response that gives back its scheduler slot exactly once,
+    when the stream is exhausted, closed or garbage collected, even if it was never started.
+    """
+
+    def __init__(self, scheduler: "Scheduler", response, ticket: Ticket):
+        self.response = iter(response)
+        self._finalizer = weakref.finalize(self, scheduler.release, ticket)
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        try:
+            return next(self.response)
+        except BaseException:
+            self.close()
+            raise
+
+    def close(self):
+        try:
+            close = getattr(self.response, "close", None)
+            if close is not None:
+                close()
+        finally:
+            self._finalizer()
+
+
+class Scheduler:
+    """
+    Admission control in front of the LLM classes.
+
+    Requests are admitted by priority class first (interactive before batch), then by
+    weighted fair queuing across tenants within the same class, as long as the
+    provider and model concurrency caps allow it. A blocked request does not hold back
+    requests for other providers or models.
+
+    Each tenant should use its own LLM instance, since the message thread is not shared safely.
+    """
+
+    def __init__(
+        self,
+        provider_limits: Optional[dict] = None,
+        model_limits: Optional[dict] = None,
+        default_limit: int = 4,
+        tenant_weights: Optional[dict] = None,
+        interactive_reserve: int = 0,
+    ):
+        """
+        Args:
+            provider_limits: Maximum concurrent requests per Provider.
+            model_limits: Maximum concurrent requests per (Provider, model name).
+            default_limit: Maximum concurrent requests for providers not in provider_limits.
+            tenant_weights: Share of the capacity given to each tenant (defaults to 1.0).
+            interactive_reserve: Provider slots that batch requests are never allowed to take.
+
+        Raises:
+            ValueError: If a tenant weight is not positive, or if the interactive reserve
+                leaves no slot to batch requests on an enabled provider (limit above 0).
+        """
+        for tenant, weight in (tenant_weights or {}).items():
+            if weight <= 0:
+                raise ValueError(f"The weight of tenant '{tenant}' should be positive, got {weight}")
+        if interactive_reserve > 0:
+            for limit in [default_limit, *(provider_limits or {}).values()]:
+                if limit > 0 and not limit > interactive_reserve:
+                    raise ValueError(f"interactive_reserve={interactive_reserve} leaves no slot to batch requests with a limit of {limit}")
+
+        self.provider_limits = provider_limits or {}
+        self.model_limits = model_limits or {}
+        self.default_limit = default_limit
+        self.tenant_weights = tenant_weights or {}
+        self.interactive_reserve = interactive_reserve
+
+        self._lock = threading.Lock()
+        self._waiting = []
+        self._sequence = itertools.count()
+        self._running_providers = defaultdict(int)
+        self._running_models = defaultdict(int)
+        self._running_priorities = defaultdict(int)
+        self._virtual_time = defaultdict(float)
+        self._max_finish = defaultdict(float)
+        # Fair queuing state of each (priority, tenant): the finish tag of its last request, and its
+        # requests issued since its oldest outstanding one, so a timed-out request can be taken back.
+        self._tenants = {}
+        # Heap of (finish tag, tenant) for each priority, to forget tenants with nothing outstanding
+        # once the virtual time has caught up with them.
+        self._idle_tenants = defaultdict(list)
+        self._queue_times = {priority: {"count": 0, "total": 0.0, "max": 0.0} for priority in Priority}
+
+    def provider_limit(self, provider: Provider):
+        return self.provider_limits.get(provider, self.default_limit)
+
+    def acquire(self, provider: Provider, model: str, priority: Priority = Priority.INTERACTIVE,
+                tenant: str = "default", cost: float = 1.0, timeout: Optional[float] = None):
+        """Wait for a slot for the given provider and model.
+
+        Args:
+            provider: The provider the request is sent to.
+            model: The model the request is sent to.
+            priority: The priority class of the request.
+            tenant: The tenant (or session) the request is accounted to.
+            cost: The relative cost of the request for fair queuing.
+            timeout: Maximum number of seconds to wait, None to wait forever.
+
+        Returns:
+            The Ticket holding the slot, to be passed to release().
+
+        Raises:
+            TimeoutError: If no slot became available within the timeout.
+        """
+        weight = self.tenant_weights.get(tenant, 1.0)
+        with self._lock:
+            state = self._tenants.setdefault((priority, tenant), {"finish": 0.0, "tickets": []})
+            ticket = Ticket(provider, model, priority, tenant, self._virtual_time[priority],
+                            state["finish"], cost / weight, next(self._sequence))
+            state["finish"] = ticket.finish
+            state["tickets"].append(ticket)
+            self._max_finish[priority] = max(self._max_finish[priority], ticket.finish)
+            self._waiting.append(ticket)
+            self._dispatch()
+
+        if not ticket.granted.wait(timeout):
+            with self._lock:
+                if ticket in self._waiting:
+                    self._waiting.remove(ticket)
+                    self._withdraw(ticket)
+                    raise TimeoutError(f"No slot available for {provider.name}/{model} within {timeout}s")
+
+        logger.debug(f"Admitted {priority.name} request of '{tenant}' to {provider.name}/{model} after {ticket.queue_time:.3f}s")
+        return ticket
+
+    def release(self, ticket: Ticket):
+        """Give back the slot held by a ticket and admit the next waiting requests.
+
+        Args:
+            ticket: The Ticket returned by acquire().
+        """
+        with self._lock:
+            self._running_providers[ticket.provider] -= 1
+            self._running_models[(ticket.provider, ticket.model)] -= 1
+            self._running_priorities[ticket.priority] -= 1
+            ticket.released = True
+            self._forget_released(ticket.priority, ticket.tenant)
+            self._dispatch()
+
+    @contextmanager
+    def slot(self, provider: Provider, model: str, priority: Priority = Priority.INTERACTIVE,
+             tenant: str = "default", cost: float = 1.0, timeout: Optional[float] = None):
+        """Hold a slot for the duration of a with block. See acquire() for the arguments."""
+        ticket = self.acquire(provider, model, priority, tenant, cost, timeout)
+        try:
+            yield ticket
+        finally:
+            self.release(ticket)
+
+    def chat(self, llm: LLM, message: str, priority: Priority = Priority.INTERACTIVE,
+             tenant: str = "default", cost: float = 1.0, timeout: Optional[float] = None):
+        """Chat with the model once a slot is available.
+
+        When streaming, the slot is held until the returned iterator is exhausted, closed or
+        garbage collected.
+
+        Args:
+            llm: The LLM to chat with.
+            message: The message to send to the model.
+            priority: The priority class of the request.
+            tenant: The tenant (or session) the request is accounted to.
+            cost: The relative cost of the request for fair queuing.
+            timeout: Maximum number of seconds to wait for a slot, None to wait forever.
+
+        Returns:
+            The response from the model
+        """
+        ticket = self.acquire(llm.config.provider, llm.config.model, priority, tenant, cost, timeout)
+        try:
+            response = llm.chat(message=message)
+        except BaseException:
+            self.release(ticket)
+            raise
+
+        if llm.config.stream:
+            return StreamSlot(self, response, ticket)
+
+        self.release(ticket)
+        return response
+
+    def _withdraw(self, ticket: Ticket):
+        # Called with the lock held: take back a request that was never admitted, so that it does not
+        # count against the tenant's share. The tags of the tenant's later requests are recomputed
+        # as if it had never been issued.
+        state = self._tenants[(ticket.priority, ticket.tenant)]
+        tickets = state["tickets"]
+        index = tickets.index(ticket)
+        tickets.pop(index)
+
+        finish = ticket.previous_finish
+        for later in tickets[index:]:
+            later.previous_finish = finish
+            if not later.granted.is_set():
+                later.start = max(later.virtual_time, finish)
+            finish = later.finish
+        state["finish"] = finish
+        self._forget_released(ticket.priority, ticket.tenant)
+
+    def _forget_released(self, priority: Priority, tenant: str):
+        # Called with the lock held: drop the tenant's released requests that no outstanding request
+        # precedes, and mark the tenant idle once it has nothing outstanding.
+        key = (priority, tenant)
+        state = self._tenants[key]
+        tickets = state["tickets"]
+        while tickets and tickets[0].released:
+            tickets.pop(0)
+        if not tickets:
+            heapq.heappush(self._idle_tenants[priority], (state["finish"], tenant))
+
+    def _prune_idle_tenants(self, priority: Priority):
+        # Called with the lock held: a tenant with nothing outstanding whose finish tag is behind the
+        # virtual time would start at the virtual time anyway, so its state can be dropped.
+        idle = self._idle_tenants[priority]
+        while idle and idle[0][0] <= self._virtual_time[priority]:
+            finish, tenant = heapq.heappop(idle)
+            state = self._tenants.get((priority, tenant))
+            if state is not None and not state["tickets"] and state["finish"] <= finish:
+                del self._tenants[(priority, tenant)]
+
+    def _has_capacity(self, ticket: Ticket):
+        limit = self.provider_limit(ticket.provider)
+        if ticket.priority is not Priority.INTERACTIVE:
+            limit -= self.interactive_reserve
+        if self._running_providers[ticket.provider] >= limit:
+            return False
+        model_key = (ticket.provider, ticket.model)
+        model_limit = self.model_limits.get(model_key)
+        if model_limit is not None and self._running_models[model_key] >= model_limit:
+            return False
+        return True
+
+    def _dispatch(self):
+        # Called with the lock held: admit every waiting ticket that fits, in priority and fair-share order.
+        for ticket in sorted(self._waiting, key=Ticket.sort_key):
+            if not self._has_capacity(ticket):
+                continue
+            self._waiting.remove(ticket)
+            self._running_providers[ticket.provider] += 1
+            self._running_models[(ticket.provider, ticket.model)] += 1
+            self._running_priorities[ticket.priority] += 1
+            self._virtual_time[ticket.priority] = max(self._virtual_time[ticket.priority], ticket.start)
+
+            ticket.queue_time = time.monotonic() - ticket.enqueued_at
+            metrics = self._queue_times[ticket.priority]
+            metrics["count"] += 1
+            metrics["total"] += ticket.queue_time
+            metrics["max"] = max(metrics["max"], ticket.queue_time)
+            ticket.granted.set()
+
+        for priority in Priority:
+            # Once a class has nothing waiting or running, its virtual time catches up with the
+            # tags already handed out, so returning tenants start on an equal footing.
+            if not self._running_priorities[priority] and not any(t.priority is priority for t in self._waiting):
+                self._virtual_time[priority] = max(self._virtual_time[priority], self._max_finish[priority])
+            self._prune_idle_tenants(priority)
+
+    def stats(self):
+        """Return the queue-time metrics and the current load of the scheduler.
+
+        Returns:
+            A dict with, for each priority class, the number of admitted requests and the
+            mean and max queue time in seconds, plus the waiting and running counts.
+        """
+        with self._lock:
+            stats = {}
+            for priority, metrics in self._queue_times.items():
+                count = metrics["count"]
+                stats[priority.name.lower()] = {
+                    "admitted": count,
+                    "waiting": sum(1 for ticket in self._waiting if ticket.priority is priority),
+                    "mean_queue_time": metrics["total"] / count if count else 0.0,
+                    "max_queue_time": metrics["max"],
+                }
+            stats["running"] = {provider.name: count for provider, count in self._running_providers.items() if count}
+            return stats
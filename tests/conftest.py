@@ -0,0 +1,5 @@
+import os
+import sys
+
+# The modules are imported by their top-level names, as when running from src/llmanager.
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src", "llmanager"))
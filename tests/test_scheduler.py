@@ -0,0 +1,96 @@
+import time
+import threading
+
+import pytest
+
+from provider import Provider
+from scheduler import Scheduler, Priority
+
+
+def wait_until(condition, timeout=2.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "condition not reached"
+        time.sleep(0.005)
+
+
+def acquire_in_thread(scheduler, tenant, timeout=None):
+    result = {}
+
+    def run():
+        try:
+            result["ticket"] = scheduler.acquire(Provider.OPENAI, "gpt", tenant=tenant, timeout=timeout)
+        except TimeoutError as e:
+            result["error"] = e
+
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+    return thread, result
+
+
+def waiting_starts(scheduler, tenant):
+    return sorted(ticket.start for ticket in scheduler._waiting if ticket.tenant == tenant)
+
+
+def test_timeout_with_later_same_tenant_tickets_queued():
+    scheduler = Scheduler(default_limit=1)
+    holder = scheduler.acquire(Provider.OPENAI, "gpt", tenant="holder")
+
+    a1_thread, a1 = acquire_in_thread(scheduler, "a", timeout=0.1)
+    wait_until(lambda: len(scheduler._waiting) == 1)
+    acquire_in_thread(scheduler, "a")
+    wait_until(lambda: len(scheduler._waiting) == 2)
+    assert waiting_starts(scheduler, "a") == [0.0, 1.0]
+
+    a1_thread.join()
+    assert isinstance(a1.get("error"), TimeoutError)
+    # a2 takes the place of a1 instead of keeping the tag a1 pushed it to.
+    assert waiting_starts(scheduler, "a") == [0.0]
+
+    acquire_in_thread(scheduler, "a")
+    wait_until(lambda: len(scheduler._waiting) == 2)
+    assert waiting_starts(scheduler, "a") == [0.0, 1.0]
+
+    scheduler.release(holder)
+
+
+def test_disabled_provider_without_reserve():
+    Scheduler(provider_limits={Provider.OLLAMA: 0})
+    Scheduler(provider_limits={Provider.OLLAMA: 0}, default_limit=4, interactive_reserve=2)
+    with pytest.raises(ValueError):
+        Scheduler(default_limit=2, interactive_reserve=2)
+
+
+def test_non_positive_tenant_weight():
+    with pytest.raises(ValueError):
+        Scheduler(tenant_weights={"a": 0})
+
+
+def test_idle_tenants_are_forgotten():
+    scheduler = Scheduler(default_limit=1)
+    for session in range(100):
+        with scheduler.slot(Provider.OPENAI, "gpt", tenant=f"session-{session}"):
+            pass
+    assert scheduler._tenants == {}
+
+
+def test_chat_cost_is_charged_to_the_tenant():
+    class StubLLM:
+        class config:
+            provider = Provider.OPENAI
+            model = "gpt"
+            stream = False
+
+        def chat(self, message):
+            return message
+
+    scheduler = Scheduler(default_limit=1)
+    holder = scheduler.acquire(Provider.OPENAI, "gpt", tenant="holder")
+    thread = threading.Thread(
+        target=scheduler.chat, args=(StubLLM(), "hi"), kwargs={"tenant": "batch", "cost": 5.0}, daemon=True
+    )
+    thread.start()
+    wait_until(lambda: len(scheduler._waiting) == 1)
+    assert scheduler._waiting[0].finish == 5.0
+    scheduler.release(holder)
+    thread.join()